@@ -0,0 +1,20 @@
+from asyncconnectionpool import AsyncHTTPConnectionPool
+import asyncio
+import time
+
+
+async def main():
+    pool = AsyncHTTPConnectionPool('167.71.232.193', 80, None, 15)
+
+    async def make_reqs(i):
+        for _ in range(5):
+            res = await pool.get_url('/')
+
+    start = time.time()
+    await asyncio.gather(*[make_reqs(i) for i in range(40)])
+
+    print("Executed asyncio pool in", time.time() - start)
+    await pool.close()
+
+
+asyncio.run(main())
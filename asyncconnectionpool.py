@@ -0,0 +1,223 @@
+import asyncio
+
+from connectionpool import HTTPResponse, MaxRetryError, encode_fields, encode_request
+
+
+# Pool objects
+
+class AsyncHTTPConnectionPool(object):
+    """
+    asyncio connection pool for one host. A single event loop thread can
+    drive many requests at once, instead of one blocked thread per request.
+
+    host
+        Host used for this HTTP Connection (e.g. "localhost"), passed into
+        asyncio.open_connection()
+
+    port
+        Port used for this HTTP Connection (None is equivalent to 80), passed
+        into asyncio.open_connection()
+
+    timeout
+        Timeout for each individual request, including waiting for a free
+        connection, can be a float. None disables timeout.
+
+    maxsize
+        Number of connections that can be open at a time. When none are free,
+        requests wait until a connection has been released (like
+        HTTPConnectionPool with ``block`` set to True).
+
+    Redirects are not followed.
+    """
+
+    def __init__(self, host, port=None, timeout=None, maxsize=1):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool = asyncio.Queue(maxsize)
+
+        # Fill the queue up so that doing get() on it will block properly
+        [self.pool.put_nowait(None) for _ in range(maxsize)]
+
+        self.num_connections = 0
+        self.num_requests = 0
+
+    async def _new_conn(self):
+        """
+        Return a fresh (reader, writer) pair.
+        """
+        self.num_connections += 1
+        return await asyncio.open_connection(self.host, self.port or 80)
+
+    async def _get_conn(self):
+        """
+        Get a connection. Will return a pooled connection if one is available.
+        Otherwise, a fresh connection is returned.
+        """
+        conn = await self.pool.get()
+        if conn is not None and (conn[0].at_eof() or conn[1].is_closing()):
+            # The server has closed it while it was idle
+            conn[1].close()
+            conn = None
+
+        if conn is None:
+            try:
+                conn = await self._new_conn()
+            except BaseException:
+                # Couldn't connect (or were cancelled), so give the slot back
+                self._put_conn(None)
+                raise
+
+        return conn
+
+    def _put_conn(self, conn):
+        """
+        Put a connection back into the pool. None gives up the slot of a
+        connection that was closed instead of being returned.
+        """
+        self.pool.put_nowait(conn)
+
+    async def _read_response(self, reader, method):
+        """
+        Read one response off ``reader`` and return it along with whether the
+        connection can be reused afterwards.
+        """
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError("Remote end closed connection without response")
+            version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+            status = int(status)
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                name, value = name.strip().lower(), value.strip()
+                if name in headers:
+                    headers[name] += ', ' + value
+                else:
+                    headers[name] = value
+
+            # Interim 1xx responses (e.g. 100 Continue, 103 Early Hints) have
+            # no body and are followed by the real one, skip them like httplib
+            if not 100 <= status < 200 or status == 101:
+                break
+
+        reusable = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        if status == 101:
+            # The connection now speaks another protocol
+            data = b''
+            reusable = False
+        elif method == 'HEAD' or status in (204, 304):
+            data = b''
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0], 16)
+                if not size:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            # Skip any trailers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            data = b''.join(chunks)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            # The body runs until the server closes the connection
+            data = await reader.read()
+            reusable = False
+
+        response = HTTPResponse(data=data,
+                                headers=headers,
+                                status=status,
+                                version=11 if version == 'HTTP/1.1' else 10,
+                                reason=reason)
+        return response, reusable
+
+    async def _request(self, conn, method, url, body, headers):
+        reader, writer = conn
+        writer.write(encode_request(self.host, self.port, method, url, headers, body))
+        await writer.drain()
+        return await self._read_response(reader, method)
+
+    async def urlopen(self, method, url, body=None, headers=None, retries=3):
+        """
+        Get a connection from the pool and perform an HTTP request.
+
+        method
+            HTTP request method (such as GET, POST, PUT, etc.)
+
+        body
+            Data to send in the request body.
+
+        headers
+            Custom headers to send (such as User-Agent, If-None-Match, etc.)
+
+        retries
+            Number of retries to allow before raising a MaxRetryError exception.
+        """
+        if headers is None:
+            headers = {}
+
+        while True:
+            if retries < 0:
+                raise MaxRetryError("Max retries exceeded for url: %s" % url)
+
+            conn = None
+            try:
+                # Request a connection from the queue
+                conn = await asyncio.wait_for(self._get_conn(), self.timeout)
+
+                # Make the request
+                self.num_requests += 1
+                response, reusable = await asyncio.wait_for(
+                    self._request(conn, method, url, body, headers), self.timeout)
+
+                # Put the connection back to be reused
+                if reusable:
+                    self._put_conn(conn)
+                    conn = None
+
+            except asyncio.TimeoutError:
+                raise TimeoutError("Request timed out after %f seconds" % self.timeout)
+
+            except (asyncio.IncompleteReadError, ValueError, OSError) as e:
+                print("Retrying (%d attempts remain) after connection broken by '%r': %s" % (retries, e, url))
+                retries -= 1
+                continue  # Try again
+
+            finally:
+                if conn is not None:
+                    # Either the request failed half-way or the server won't
+                    # keep the connection open. Close it and free its slot.
+                    conn[1].close()
+                    self._put_conn(None)
+
+            return response
+
+    async def get_url(self, url, fields=None, headers=None, retries=3):
+        """
+        Wrapper for performing GET with urlopen (see urlopen for more details).
+
+        Supports an optional ``fields`` parameter of key/value strings. If
+        provided, they will be added to the url.
+        """
+        if fields:
+            url += '?' + encode_fields(fields)
+        return await self.urlopen('GET', url, headers=headers, retries=retries)
+
+    async def close(self):
+        """
+        Close all idle connections.
+        """
+        while not self.pool.empty():
+            conn = self.pool.get_nowait()
+            if conn is not None:
+                conn[1].close()
+                await conn[1].wait_closed()
@@ -1,8 +1,24 @@
-from queue import Queue, Empty, Full
-
-from urllib.parse import urlencode
-from http.client import HTTPConnection, HTTPException
-from socket import error
+from collections import deque
+from functools import lru_cache
+from io import BufferedReader
+from queue import Empty
+from threading import BoundedSemaphore, current_thread, local
+from time import monotonic
+from types import MappingProxyType
+from weakref import finalize, ref
+
+from urllib.parse import urlencode, urljoin, urlsplit
+from http.client import HTTPConnection, HTTPException, HTTPResponse as HTTPLibResponse
+import select
+import socket
+from socket import error, SocketIO
+
+# Read-only so a single instance can be shared by every request
+_EMPTY_HEADERS = MappingProxyType({})
+_KEEP_ALIVE_HEADERS = MappingProxyType({'Connection': 'keep-alive'})
+
+# Per-thread scratch buffers for HTTPResponse.drain
+_drain_buffers = local()
 
 # Exceptions
 class HTTPError(Exception):
@@ -24,6 +40,9 @@ class HTTPResponse:
     Similar to httplib's HTTPResponse but the data is pre-loaded.
     """
 
+    # Responses are created once per request, skip the per-instance __dict__
+    __slots__ = ('data', 'headers', 'status', 'version', 'reason')
+
     def __init__(self, data='', headers=None, status=0, version=0, reason=None):
         if headers is None:
             headers = {}
@@ -34,26 +53,270 @@ class HTTPResponse:
         self.reason = reason
 
     @staticmethod
-    def from_httplib(r):
+    def from_httplib(r, preload_content=True):
         """
         Given an httplib.HTTPResponse instance, return a corresponding
         urllib3.HTTPResponse object.
 
+        If ``preload_content`` is False the body is read off the socket and
+        thrown away (see HTTPResponse.drain) and ``data`` is left empty.
+
+        Header names are lowercased, and repeated headers (e.g. Set-Cookie) are
+        joined with ', ' instead of only the last one being kept.
+
         NOTE: This method will perform r.read() which will have side effects
         on the original http.HTTPResponse object.
         """
-        return HTTPResponse(data=r.read(),
-                            headers=dict(r.getheaders()),
+        if preload_content:
+            data = r.read()
+        else:
+            HTTPResponse.drain(r)
+            data = b''
+
+        headers = {}
+        for name, value in r.getheaders():
+            name = name.lower()
+            if name in headers:
+                headers[name] += ', ' + value
+            else:
+                headers[name] = value
+
+        return HTTPResponse(data=data,
+                            headers=headers,
                             status=r.status,
                             version=r.version,
                             reason=r.reason)
 
+    @staticmethod
+    def drain(r, bufsize=65536):
+        """
+        Read the rest of the httplib.HTTPResponse ``r`` into a scratch buffer
+        and return the number of bytes read.
+
+        The body still has to come off the socket before the connection can be
+        reused, but this way it is never turned into a bytes object. The
+        scratch buffer is allocated once per thread and reused.
+        """
+        buf = getattr(_drain_buffers, 'buf', None)
+        if buf is None or len(buf) != bufsize:
+            buf = _drain_buffers.buf = memoryview(bytearray(bufsize))
+        total = 0
+        while True:
+            n = r.readinto(buf)
+            if not n:
+                return total
+            total += n
+
     # Backwards-compatibility methods for httplib.HTTPResponse
     def getheaders(self):
         return self.headers
 
     def getheader(self, name, default=None):
-        return self.headers.get(name, default)
+        return self.headers.get(name.lower(), default)
+
+
+# Helpers
+
+def is_connection_alive(conn):
+    """
+    Return False if the server has closed (or sent unsolicited data on) the
+    idle connection ``conn``. Connections that haven't been opened yet are
+    considered alive.
+
+    The socket is polled with a zero timeout so this never blocks.
+    """
+    sock = conn.sock
+    if sock is None:
+        return True
+    # An idle keep-alive socket should have nothing to read; if it is
+    # readable the server either sent a FIN or garbage we can't use.
+    try:
+        if hasattr(select, 'poll'):
+            # Unlike select(), poll() works for descriptors above FD_SETSIZE
+            poller = select.poll()
+            poller.register(sock, select.POLLIN)
+            return not poller.poll(0)
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (ValueError, error):
+        return False
+    return not readable
+
+
+def encode_request(host, port, method, url, headers=None, body=None):
+    """
+    Return the raw bytes of an HTTP/1.1 request for ``url`` on ``host`` and
+    ``port``, followed by ``body`` (bytes or str) if one is given.
+    """
+    if headers is None:
+        headers = _EMPTY_HEADERS
+
+    host = '[%s]' % host if ':' in host else host
+    if port and port != 80:
+        host = '%s:%d' % (host, port)
+
+    request_headers = {'Host': host, 'Accept-Encoding': 'identity', 'Connection': 'keep-alive'}
+    if body is not None:
+        if isinstance(body, str):
+            body = body.encode('latin-1')
+        request_headers['Content-Length'] = str(len(body))
+    if headers:
+        # Header names are case-insensitive, so a caller's 'host' replaces
+        # our 'Host' instead of being sent alongside it
+        supplied = {name.lower() for name in headers}
+        request_headers = {name: value for name, value in request_headers.items()
+                           if name.lower() not in supplied}
+        request_headers.update(headers)
+
+    lines = ['%s %s HTTP/1.1' % (method, url or '/')]
+    lines.extend('%s: %s' % item for item in request_headers.items())
+    lines.append('\r\n')
+    return '\r\n'.join(lines).encode('latin-1') + (body or b'')
+
+
+def get_host(url):
+    """
+    Given a url, return its host and port (None if it's not there).
+
+    For example:
+    >>> get_host('http://google.com/mail/')
+    ('google.com', None)
+    >>> get_host('google.com:80')
+    ('google.com', 80)
+    """
+    # urlsplit only recognises the netloc after a '//'
+    parts = urlsplit(url if '//' in url else '//' + url)
+    return parts.hostname, parts.port
+
+
+@lru_cache(maxsize=256)
+def _urlencode_items(items):
+    return urlencode(items)
+
+
+def encode_fields(fields):
+    """
+    Return ``fields`` (a mapping or a sequence of key/value pairs) encoded as
+    a query string, the same way urlencode does.
+
+    Repeated requests tend to send the same fields, so the encoded strings are
+    kept in a small LRU cache keyed on the items themselves. Only pairs of
+    strings are cached, since e.g. 1 and True compare equal but encode
+    differently; anything else is passed to urlencode as is.
+    """
+    items = tuple(fields.items()) if hasattr(fields, 'items') else tuple(fields)
+    for item in items:
+        if type(item) is not tuple or len(item) != 2 or type(item[0]) is not str or type(item[1]) is not str:
+            return urlencode(fields)
+    return _urlencode_items(items)
+
+
+class PipelineReader(BufferedReader):
+    """
+    Buffered socket reader shared by consecutive pipelined responses.
+
+    A read for one response may already pull in the start of the next one, so
+    every response has to be parsed from the same buffer. httplib closes its
+    file once a body has been read; that is ignored here and ``release``
+    closes the reader for real.
+    """
+
+    def __init__(self, sock):
+        super().__init__(SocketIO(sock, 'rb'))
+
+    def makefile(self, mode='rb'):
+        # Lets the reader stand in for the socket httplib.HTTPResponse expects
+        return self
+
+    def close(self):
+        pass
+
+    def release(self):
+        super().close()
+
+
+# Connection objects
+
+# Seconds a resolved address is reused for before looking it up again
+DNS_TTL = 60
+
+# (host, port) -> (expiry, getaddrinfo() results), shared by all connections
+_addr_cache = {}
+
+
+def _resolve(host, port):
+    """
+    Return the getaddrinfo() results for ``host`` and ``port``, looking them
+    up at most once every DNS_TTL seconds.
+    """
+    key = (host, port)
+    now = monotonic()
+    cached = _addr_cache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    _addr_cache[key] = (now + DNS_TTL, addresses)
+    return addresses
+
+
+def _create_connection(address, timeout=None, source_address=None):
+    """
+    Drop-in for socket.create_connection (which httplib uses to connect)
+    that resolves ``address`` through the shared address cache.
+    """
+    err = None
+    for family, type_, proto, _, sockaddr in _resolve(*address):
+        sock = socket.socket(family, type_, proto)
+        try:
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except error as e:
+            err = e
+            sock.close()
+
+    # The cached addresses may have gone stale, look them up next time
+    _addr_cache.pop(address, None)
+    if err is not None:
+        raise err
+    raise error("getaddrinfo returned an empty list for %s" % (address,))
+
+
+class KeepAliveHTTPConnection(HTTPConnection):
+    """
+    HTTPConnection with TCP keepalive enabled on its socket.
+
+    Idle pooled connections that the network silently drops are then reset by
+    the kernel, which the liveness check in HTTPConnectionPool._get_conn picks
+    up before a request is sent on them. httplib already sets TCP_NODELAY.
+
+    Host names are resolved through a cache shared by all connections, see
+    DNS_TTL.
+    """
+
+    # Seconds idle before probing, seconds between probes, probes before reset
+    keepalive_options = (('TCP_KEEPIDLE', 60), ('TCP_KEEPINTVL', 10), ('TCP_KEEPCNT', 3))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # A plain function, so connections don't reference anything else
+        self._create_connection = _create_connection
+
+    def connect(self):
+        super().connect()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for name, value in self.keepalive_options:
+            # Not every platform lets these be tuned per socket
+            if hasattr(socket, name):
+                self.sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+def _close_conn_ref(conn_ref):
+    conn = conn_ref()
+    if conn is not None:
+        conn.close()
 
 
 # Pool objects
@@ -87,28 +350,41 @@ class HTTPConnectionPool(object):
         particular multithreaded situations where one does not want to use more
         than maxsize connections per host to prevent flooding.
 
+    use_thread_local
+        If set to True, every thread keeps its own connection instead of
+        sharing the pool, so checking out a connection never contends with
+        other threads. ``maxsize`` and ``block`` are ignored in this mode and
+        a thread's connection is closed when the thread exits.
+
     """
 
-    def __init__(self, host, port=None, timeout=None, maxsize=1, block=False):
+    def __init__(self, host, port=None, timeout=None, maxsize=1, block=False,
+                 use_thread_local=False):
         self.host = host
         self.port = port
         self.timeout = timeout
-        self.pool = Queue(maxsize)
+        self.maxsize = maxsize
         self.block = block
+        self._tls = local() if use_thread_local else None
 
-        # Fill the queue up so that doing get() on it will block properly
-        [self.pool.put(None) for _ in range(maxsize)]
+        # Idle connections live in a plain deque; append() and popleft() are
+        # atomic so no lock is taken on the hot path. Blocking mode bounds the
+        # number of checked-out connections with a semaphore instead. The pool
+        # starts out empty and grows as connections are returned.
+        self.pool = deque()
+        self._sem = BoundedSemaphore(maxsize) if block else None
 
         self.num_connections = 0
         self.num_requests = 0
 
     def _new_conn(self):
         """
-        Return a fresh HTTPConnection.
+        Return a fresh KeepAliveHTTPConnection.
         """
         self.num_connections += 1
         # print("Starting new HTTP connection (%d): %s" % (self.num_connections, self.host))
-        return HTTPConnection(host=self.host, port=self.port)
+        # Sockets start out with the pool's timeout, see _check_timeout
+        return KeepAliveHTTPConnection(host=self.host, port=self.port, timeout=self.timeout)
 
     def _get_conn(self, timeout=None):
         """
@@ -116,14 +392,31 @@ class HTTPConnectionPool(object):
         Otherwise, a fresh connection is returned.
         """
         # print("_get_conn called with timeout", timeout)
+        if self._tls is not None:
+            conn = getattr(self._tls, 'conn', None)
+            if conn is None or not is_connection_alive(conn):
+                if conn is not None:
+                    conn.close()
+                conn = self._new_conn()
+                self._set_local_conn(conn)
+            return conn
+
+        if self._sem is not None and not self._sem.acquire(timeout=timeout):
+            raise Empty
+
         conn = None
         try:
-            conn = self.pool.get(block=self.block, timeout=timeout)
+            conn = self.pool.popleft()
             # print("conn found", conn)
-        except Empty:
-            # print("Empty exception called")
+        except IndexError:
+            # print("Pool is empty")
             pass  # Oh well, we'll create a new connection then
 
+        # Probe outside of any locking so a dead socket only costs a poll
+        if conn is not None and not is_connection_alive(conn):
+            conn.close()
+            conn = None
+
         return conn or self._new_conn()
 
     def _put_conn(self, conn):
@@ -132,14 +425,112 @@ class HTTPConnectionPool(object):
         If the pool is already full, the connection is discarded because we
         exceeded maxsize. If connections are discarded frequently, then maxsize
         should be increased.
+
+        Passing None gives up the slot of a connection that was closed instead
+        of being returned.
         """
-        try:
-            self.pool.put(conn, block=False)
-        except Full:
-            # This should never happen if self.block == True
-            print("HttpConnectionPool is full, discarding connection: %s" % self.host)
+        if self._tls is not None:
+            # The thread's connection stays put unless it had to be closed
+            if conn is None:
+                self._set_local_conn(None)
+            return
+
+        if conn is not None:
+            if self._sem is None and 0 < self.maxsize <= len(self.pool):
+                # This should never happen if self.block == True
+                print("HttpConnectionPool is full, discarding connection: %s" % self.host)
+                return
 
-    def urlopen(self, method, url, body=None, headers=None, retries=3, redirect=True):
+            self.pool.append(conn)
+
+        if self._sem is not None:
+            self._sem.release()
+
+    def _check_timeout(self, conn):
+        """
+        Make sure the socket of ``conn`` uses the pool's current timeout.
+
+        New sockets already get it when they connect, so settimeout() (a
+        syscall) is only needed if self.timeout has changed since.
+        """
+        if conn.sock.gettimeout() != self.timeout:
+            conn.sock.settimeout(self.timeout)
+
+    def _set_local_conn(self, conn):
+        """
+        Make ``conn`` the calling thread's connection (None forgets it) and
+        have it closed when the thread exits.
+
+        The exit hook only holds a weak reference, so a dropped pool doesn't
+        keep its connections open until every thread has finished.
+        """
+        closer = getattr(self._tls, 'closer', None)
+        if closer is not None:
+            closer.detach()
+        self._tls.conn = conn
+        self._tls.closer = finalize(current_thread(), _close_conn_ref, ref(conn)) if conn is not None else None
+
+    def prewarm(self, n):
+        """
+        Open up to ``n`` connections (capped at maxsize, if there is one)
+        ahead of time and add them to the pool, so the first requests don't
+        each pay for a TCP handshake.
+
+        Not supported with ``use_thread_local``, where each thread opens its
+        own connection on first use.
+        """
+        if self._tls is not None:
+            raise ValueError("prewarm() can't be used with use_thread_local=True")
+        if self.maxsize > 0:
+            n = min(n, self.maxsize)
+        for _ in range(n - len(self.pool)):
+            conn = self._new_conn()
+            conn.connect()
+            self.pool.append(conn)
+
+    def close(self):
+        """
+        Close all idle connections in the pool (and, with use_thread_local,
+        the calling thread's connection). Connections that are checked out
+        at the time are not affected.
+        """
+        while True:
+            try:
+                conn = self.pool.popleft()
+            except IndexError:
+                break
+            conn.close()
+
+        if self._tls is not None and getattr(self._tls, 'conn', None) is not None:
+            self._tls.conn.close()
+            self._set_local_conn(None)
+
+    def is_same_host(self, url):
+        """
+        Check if the given ``url`` is a member of the same host as this
+        connection pool. Relative urls always are, urls with a scheme other
+        than http never are.
+        """
+        # Redirects are usually to an absolute path on the same server, which
+        # needs no parsing ('//' would be a scheme-relative url).
+        if url[:1] == '/' and url[1:2] != '/':
+            return True
+
+        parts = urlsplit(url)
+        if parts.scheme and (parts.scheme != 'http' or not parts.netloc):
+            # e.g. https://..., mailto:... or myapp:callback
+            return False
+        if not parts.netloc:
+            return True
+        try:
+            port = parts.port
+        except ValueError:
+            # Malformed port, so this can't be followed at all
+            return False
+        return (parts.hostname, port or 80) == (self.host.lower(), self.port or 80)
+
+    def urlopen(self, method, url, body=None, headers=None, retries=3, redirect=True,
+                preload_content=True):
         """
         Get a connection from the pool and perform an HTTP request.
 
@@ -158,58 +549,256 @@ class HTTPConnectionPool(object):
 
         redirect
             Automatically handle redirects (status codes 301, 302, 303, 307),
-            each redirect counts as a retry.
+            each redirect counts as a retry. Redirects to another host are
+            followed through a new, single-use pool for that host whose
+            connection is closed afterwards. Redirects to other schemes (e.g. https)
+            or to malformed urls are not followed; the 3xx response is
+            returned as is.
+
+        preload_content
+            If False, the response body is read and discarded instead of being
+            stored in ``response.data``. Useful when only the status or headers
+            are needed.
         """
+        # Ask the server to keep the socket open so it can be reused, unless
+        # the caller sent their own Connection header (in any case)
         if headers is None:
-            headers = {}
-        if retries < 0:
-            raise MaxRetryError("Max retries exceeded for url: %s" % url)
+            headers = _KEEP_ALIVE_HEADERS
+        elif not any(name.lower() == 'connection' for name in headers):
+            headers = {'Connection': 'keep-alive', **headers}
 
+        conn = None
         try:
-            # Request a connection from the queue
-            conn = self._get_conn(self.timeout)
+            while True:
+                if retries < 0:
+                    raise MaxRetryError("Max retries exceeded for url: %s" % url)
+
+                try:
+                    if conn is None:
+                        # Request a connection from the queue
+                        conn = self._get_conn(self.timeout)
+
+                    # Make the request
+                    self.num_requests += 1
+                    conn.request(method, url, body=body, headers=headers)
+                    self._check_timeout(conn)
+                    httplib_response = conn.getresponse()
+
+                    # from_httplib will perform httplib_response.read() which will have
+                    # the side effect of letting us use this connection for another
+                    # request.
+                    response = HTTPResponse.from_httplib(httplib_response, preload_content)
+
+                except (TimeoutError, Empty):
+                    # Timed out either by socket or queue
+                    raise TimeoutError("Request timed out after %f seconds" % self.timeout)
+
+                except (HTTPException, error) as e:
+                    # The connection is in an unknown state. Closing it resets
+                    # it, so the retry goes out on a fresh socket.
+                    conn.close()
+                    print("Retrying (%d attempts remain) after connection broken by '%r': %s" % (retries, e, url))
+                    retries -= 1
+                    continue  # Try again
+
+                # Handle redirection
+                if redirect and response.status in [301, 302, 303, 307] and 'location' in response.headers:  # Redirect, retry
+                    location = response.headers.get('location')
+                    if self.is_same_host(location):
+                        # Follow it on the connection we are already holding
+                        if location[:1] != '/':
+                            # A bare relative target (e.g. "page.html") isn't a
+                            # valid request-target, resolve it against the url
+                            location = urljoin(url, location)
+                        print("Redirecting %s -> %s" % (url, location))
+                        retries -= 1
+                        url = location
+                        continue
+
+                    # Either way this connection is done with, so give it back
+                    self._put_conn(conn)
+                    conn = None
+
+                    host = None
+                    if urlsplit(location).scheme in ('', 'http'):
+                        try:
+                            host, port = get_host(location)
+                        except ValueError:
+                            pass  # Malformed port
+                    if not host:
+                        # This pool only speaks plain HTTP, so leave e.g. an
+                        # upgrade to https (or a bogus location) to the caller.
+                        return response
+
+                    # Another host, so let a (single-use) pool for that host
+                    # follow the redirect.
+                    print("Redirecting %s -> %s" % (url, location))
+                    retries -= 1
+                    pool = HTTPConnectionPool(host, port=port, timeout=self.timeout)
+                    try:
+                        return pool.urlopen(method, location, body, headers, retries, redirect,
+                                            preload_content)
+                    finally:
+                        pool.close()
+
+                # Put the connection back to be reused
+                self._put_conn(conn)
+                conn = None
+                return response
+
+        finally:
+            if conn is not None:
+                # Something escaped half-way through a request, so the
+                # connection is in an unknown state. Close it and free its
+                # slot in the pool rather than handing it out again.
+                conn.close()
+                self._put_conn(None)
+
+    def prepare_request(self, method, url, headers=None):
+        """
+        Return the raw bytes of a body-less HTTP/1.1 request for ``url``.
 
-            # Make the request
-            self.num_requests += 1
-            conn.request(method, url, body=body, headers=headers)
-            conn.sock.settimeout(self.timeout)
-            httplib_response = conn.getresponse()
+        The result can be passed to urlopen_prepared as many times as needed,
+        so a request that is repeated verbatim only has to be formatted once.
+        """
+        return encode_request(self.host, self.port, method, url, headers)
 
-            # from_httplib will perform httplib_response.read() which will have
-            # the side effect of letting us use this connection for another
-            # request.
-            response = HTTPResponse.from_httplib(httplib_response)
+    def urlopen_prepared(self, raw, method='GET', retries=3, preload_content=True):
+        """
+        Send the request bytes ``raw`` (see prepare_request) on a pooled
+        connection and return the response.
 
-            # Put the connection back to be reused
-            self._put_conn(conn)
+        This skips httplib's request formatting entirely. ``method`` must match
+        the one ``raw`` was prepared with, since the response is parsed
+        differently for HEAD. Redirects are not followed.
+        """
+        conn = None
+        try:
+            while True:
+                if retries < 0:
+                    raise MaxRetryError("Max retries exceeded for prepared request: %r" % raw)
+
+                try:
+                    if conn is None:
+                        # Request a connection from the queue
+                        conn = self._get_conn(self.timeout)
+                    if conn.sock is None:
+                        conn.connect()
+
+                    # Make the request
+                    self.num_requests += 1
+                    self._check_timeout(conn)
+                    conn.sock.sendall(raw)
+                    httplib_response = HTTPLibResponse(conn.sock, method=method)
+                    httplib_response.begin()
+                    response = HTTPResponse.from_httplib(httplib_response, preload_content)
+
+                except (TimeoutError, Empty):
+                    # Timed out either by socket or queue
+                    raise TimeoutError("Request timed out after %f seconds" % self.timeout)
+
+                except (HTTPException, error) as e:
+                    # Closing resets the connection so the retry reconnects
+                    conn.close()
+                    print("Retrying (%d attempts remain) after connection broken by '%r'" % (retries, e))
+                    retries -= 1
+                    continue  # Try again
+
+                if httplib_response.will_close:
+                    # httplib isn't tracking this socket, so close it here
+                    conn.close()
+
+                # Put the connection back to be reused
+                self._put_conn(conn)
+                conn = None
+                return response
+
+        finally:
+            if conn is not None:
+                conn.close()
+                self._put_conn(None)
+
+    def urlopen_many(self, method, urls, headers=None, preload_content=True):
+        """
+        Perform one request per url on a single connection using HTTP/1.1
+        pipelining and return the responses in the same order as ``urls``.
+
+        Every request is written before any response is read, so the batch
+        costs about one round trip instead of one per url. Redirects are not
+        followed. Only use this with idempotent methods (GET, HEAD): if the
+        server stops answering part way through, the remaining urls are sent
+        again one at a time with urlopen.
+        """
+        if headers is None:
+            headers = _EMPTY_HEADERS
+        urls = list(urls)
+        responses = []
+
+        conn = None
+        reader = None
+        try:
+            conn = self._get_conn(self.timeout)
+            if conn.sock is None:
+                conn.connect()
+            self._check_timeout(conn)
+
+            self.num_requests += len(urls)
+            conn.sock.sendall(b''.join(self.prepare_request(method, url, headers) for url in urls))
+
+            # Responses come back in request order, which is the only thing
+            # associating each one with its url.
+            reader = PipelineReader(conn.sock)
+            for url in urls:
+                httplib_response = HTTPLibResponse(reader, method=method)
+                httplib_response.begin()
+                responses.append(HTTPResponse.from_httplib(httplib_response, preload_content))
+                if httplib_response.will_close:
+                    break
+            else:
+                self._put_conn(conn)
+                conn = None
 
         except (TimeoutError, Empty):
             # Timed out either by socket or queue
             raise TimeoutError("Request timed out after %f seconds" % self.timeout)
 
         except (HTTPException, error) as e:
-            print("Retrying (%d attempts remain) after connection broken by '%r': %s" % (retries, e, url))
-            return self.urlopen(method, url, body, headers, retries - 1, redirect)  # Try again
+            print("Pipeline broken by '%r' after %d of %d responses" % (e, len(responses), len(urls)))
+
+        finally:
+            if reader is not None:
+                reader.release()
+            if conn is not None:
+                conn.close()
+                self._put_conn(None)
 
-        # Handle redirection
-        if redirect and response.status in [301, 302, 303, 307] and 'location' in response.headers:  # Redirect, retry
-            print("Redirecting %s -> %s" % (url, response.headers.get('location')))
-            return self.urlopen(method, response.headers.get('location'), body, headers, retries - 1, redirect)
+        # Whatever the server didn't answer is sent again without pipelining
+        for url in urls[len(responses):]:
+            responses.append(self.urlopen(method, url, headers=headers, redirect=False,
+                                          preload_content=preload_content))
 
-        return response
+        return responses
 
-    def get_url(self, url, fields=None, headers=None, retries=3, redirect=True):
+    def get_url(self, url, fields=None, headers=None, retries=3, redirect=True,
+                preload_content=True):
         """
         Wrapper for performing GET with urlopen (see urlopen for more details).
 
         Supports an optional ``fields`` parameter of key/value strings. If
         provided, they will be added to the url.
         """
-        if headers is None:
-            headers = {}
-        if fields is None:
-            fields = {}
         if fields:
-            url += '?' + urlencode(fields)
-        return self.urlopen('GET', url, headers=headers, retries=retries, redirect=redirect)
+            url += '?' + encode_fields(fields)
+        return self.urlopen('GET', url, headers=headers, retries=retries, redirect=redirect,
+                            preload_content=preload_content)
+
 
+def connection_from_url(url, timeout=None, maxsize=1, block=False):
+    """
+    Given a url, return an HTTPConnectionPool instance for its host.
+
+    This is a shortcut for not having to determine the host of the url
+    before creating an HTTPConnectionPool instance.
+    """
+    host, port = get_host(url)
+    return HTTPConnectionPool(host, port=port, timeout=timeout, maxsize=maxsize, block=block)